@@ -1,7 +1,6 @@
 import { Router, Request, Response, NextFunction } from 'express';
 import multer from 'multer';
 import axios from 'axios';
-import FormData from 'form-data';
 import { randomUUID } from 'crypto';
 import AdmZip from 'adm-zip';
 import mime from 'mime-types';
@@ -109,11 +108,10 @@ documentsRouter.post('/upload', upload.single('file'), async (req: Request, res:
     };
     await db.collection('documents').insertOne(docRecord as any);
 
-    // Call PDF processor to get ZIP (analysis json + images)
-    const fd = new FormData();
-    fd.append('file', file.buffer, { filename: file.originalname, contentType: file.mimetype });
+    // Call PDF processor to get ZIP (analysis json + images); raw PDF body avoids multipart parsing
+    const pdfRequest = { headers: { 'Content-Type': 'application/pdf' }, params: { filename: file.originalname }, timeout: 120000 };
 
-    const zipResp = await axios.post(`${appConfig.services.pdfProcessorUrl}/extract/zip`, fd, { headers: fd.getHeaders(), responseType: 'arraybuffer', timeout: 120000 });
+    const zipResp = await axios.post(`${appConfig.services.pdfProcessorUrl}/extract/zip`, file.buffer, { ...pdfRequest, responseType: 'arraybuffer' });
 
     // Upload ZIP bundle
     const zipBuf = Buffer.from(zipResp.data);
@@ -147,10 +145,12 @@ documentsRouter.post('/upload', upload.single('file'), async (req: Request, res:
     }
 
     // Also call JSON endpoint for structured metadata/content
-    const fd2 = new FormData();
-    fd2.append('file', file.buffer, { filename: file.originalname, contentType: file.mimetype });
-    const jsonResp = await axios.post(`${appConfig.services.pdfProcessorUrl}/extract`, fd2, { headers: fd2.getHeaders(), timeout: 120000 });
+    const jsonResp = await axios.post(`${appConfig.services.pdfProcessorUrl}/extract`, file.buffer, { ...pdfRequest, params: { ...pdfRequest.params, include_full_text: 1 } });
     const result: PDFProcessingResult = jsonResp.data;
+    // The body is streamed, so failures during extraction arrive with status 200 and success: false
+    if (!result || result.success !== true) {
+      throw new Error(`PDF processing failed: ${result?.error || 'invalid response from PDF processor'}`);
+    }
 
     // Save analysis JSON to storage
     const analysisKey = `documents/${id}/processed/${id}_analysis.json`;
@@ -106,7 +106,7 @@ export interface PDFPageContent {
 }
 
 export interface PDFContent {
-  full_text: string;
+  full_text?: string; // Only present when requested (include_full_text=1)
   pages: PDFPageContent[];
   total_chars: number;
   images_count: number;
@@ -116,6 +116,7 @@ export interface PDFLayoutInfo {
   has_positioning_data: boolean;
   coordinate_system: string;
   bbox_format: string;
+  span_format?: 'aos' | 'soa'; // 'soa' only when requested with format=soa
   font_flags_decoded: boolean;
   color_format: string;
 }
@@ -189,12 +190,13 @@ export interface LayoutInfo {
   has_positioning_data: boolean;
   coordinate_system: string;
   bbox_format: string;
+  span_format?: 'aos' | 'soa'; // 'soa' only when requested with format=soa
   font_flags_decoded: boolean;
   color_format: string;
 }
 
 export interface PDFContent {
-  full_text: string;
+  full_text?: string; // Only present when requested (include_full_text=1)
   pages: PDFPageContent[];
   total_chars: number;
   images_count: number;
@@ -5,16 +5,28 @@ A lightweight HTTP service for extracting text and metadata from PDF files using
 """
 
 import os
-import json
+import mmap
+import time
+import hashlib
 import logging
 import tempfile
 import zipfile
+import multiprocessing
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
 from io import BytesIO
-from typing import Dict, Any, Optional, List, Tuple
+from typing import Callable, Dict, Any, Iterator, Optional, List, Tuple, Union
 from pathlib import Path
 
+# Keep native libraries single-threaded; concurrency comes from server workers
+os.environ.setdefault('OMP_NUM_THREADS', '1')
+
 import fitz  # PyMuPDF
-from bottle import Bottle, request, response, run, HTTPError, static_file
+import orjson
+from bottle import Bottle, BaseRequest, request, response, run, debug, HTTPError, static_file
 
 # Configure logging
 logging.basicConfig(
@@ -25,6 +37,115 @@ logger = logging.getLogger(__name__)
 
 app = Bottle()
 
+# Keep uploads up to this size in memory instead of spooling them to temp files
+BaseRequest.MEMFILE_MAX = int(os.getenv('MAX_MEMFILE_MB', 256)) * 1024 * 1024
+
+# Server worker processes (production mode)
+WORKERS = int(os.getenv('WORKERS', os.cpu_count() or 1))
+# Seconds a request may take before gunicorn restarts the worker (the backend waits 120 s)
+WORKER_TIMEOUT = int(os.getenv('WORKER_TIMEOUT', 120))
+
+# Page-level parallelism for long documents (worker processes per server worker).
+# Server workers and page workers share the CPUs: by default page workers only
+# use the cores that are not already taken by server workers.
+PAGE_WORKERS = int(os.getenv('PAGE_WORKERS', min(8, max(1, (os.cpu_count() or 1) // WORKERS))))
+PARALLEL_MIN_PAGES = int(os.getenv('PARALLEL_MIN_PAGES', 16))
+
+# Serialized /extract results for recently processed PDFs (per server worker).
+# Like page workers, the default memory budgets are shared by all server workers.
+RESULT_CACHE_ENTRIES = int(os.getenv('RESULT_CACHE_ENTRIES', 128))
+RESULT_CACHE_MB = int(os.getenv('RESULT_CACHE_MB', max(1, 512 // WORKERS)))
+RESULT_CACHE_MIN_MS = float(os.getenv('RESULT_CACHE_MIN_MS', 50))
+RESULT_CACHE_ENTRY_MB = int(os.getenv('RESULT_CACHE_ENTRY_MB', 16))
+
+# Open documents kept for repeated requests on the same PDF (per server worker)
+DOCUMENT_CACHE_ENTRIES = int(os.getenv('DOCUMENT_CACHE_ENTRIES', 16))
+DOCUMENT_CACHE_MB = int(os.getenv('DOCUMENT_CACHE_MB', max(1, 256 // WORKERS)))
+
+# Decoded font properties for every combination of the five PyMuPDF font flag bits.
+# Entries are shared between spans and must not be mutated.
+_FONT_FLAGS_TABLE = tuple(
+    {
+        "superscript": bool(flags & 2**0),
+        "italic": bool(flags & 2**1),
+        "serifed": bool(flags & 2**2),
+        "monospaced": bool(flags & 2**3),
+        "bold": bool(flags & 2**4)
+    }
+    for flags in range(2**5)
+)
+
+# Two-digit lowercase hex for every byte value, used to format span colors
+_HEX_DIGITS = tuple(f"{i:02x}" for i in range(256))
+
+# PDF content as bytes or as a zero-copy view of an uploaded file
+PDFBuffer = Union[bytes, memoryview]
+
+# Span layouts: one dict per span, or one list per span field for each line
+SPAN_FORMATS = ("aos", "soa")
+
+# Parts of the page output that can be selected with ?include=
+INCLUDE_SECTIONS = frozenset(("text", "layout", "images"))
+
+class ResultCache:
+    """Thread-safe LRU cache of serialized extraction results keyed by PDF content hash."""
+    
+    def __init__(self, max_entries: int, max_bytes: int, min_duration_ms: float = 0,
+                 max_entry_bytes: Optional[int] = None):
+        """
+        Args:
+            max_entries: Maximum number of cached results
+            max_bytes: Maximum total size of cached results
+            min_duration_ms: Only cache results that took at least this long to produce
+            max_entry_bytes: Maximum size of a single result (default: max_bytes)
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.min_duration_ms = min_duration_ms
+        self.max_entry_bytes = min(max_entry_bytes or max_bytes, max_bytes)
+        self._entries: "OrderedDict[bytes, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def make_key(content_key: bytes, *options: Any) -> bytes:
+        """Build a cache key from the PDF content key and the options that shape the result."""
+        digest = hashlib.blake2b(content_key, digest_size=16)
+        digest.update(repr(options).encode())
+        return digest.digest()
+    
+    def get(self, key: bytes) -> Optional[bytes]:
+        """Return the cached result for ``key`` and mark it most recently used."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+    
+    def put(self, key: bytes, value: bytes, duration_ms: float) -> None:
+        """Store a result, evicting least recently used entries to stay within limits."""
+        if duration_ms < self.min_duration_ms or len(value) > self.max_entry_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = value
+            self._size += len(value)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+def pdf_content_key(pdf_bytes: PDFBuffer) -> bytes:
+    """Hash the complete PDF content into the key shared by the result and document caches."""
+    return hashlib.blake2b(pdf_bytes, digest_size=16).digest()
+
+result_cache = ResultCache(RESULT_CACHE_ENTRIES, RESULT_CACHE_MB * 1024 * 1024, RESULT_CACHE_MIN_MS,
+                           max_entry_bytes=RESULT_CACHE_ENTRY_MB * 1024 * 1024)
+
 class PDFProcessor:
     """PDF processing utility class."""
     
@@ -37,17 +158,12 @@ class PDFProcessor:
             flags: Integer representing font flags
             
         Returns:
-            Dictionary with font properties
+            Dictionary with font properties (shared lookup table entry)
         """
-        return {
-            "superscript": bool(flags & 2**0),
-            "italic": bool(flags & 2**1),
-            "serifed": bool(flags & 2**2),
-            "monospaced": bool(flags & 2**3),
-            "bold": bool(flags & 2**4)
-        }
+        return _FONT_FLAGS_TABLE[flags & 0x1F]
     
     @staticmethod
+    @lru_cache(maxsize=256)
     def color_to_hex(color: int) -> str:
         """
         Convert integer color to hex string.
@@ -58,21 +174,444 @@ class PDFProcessor:
         Returns:
             Hex color string
         """
-        if color == 0:
-            return "#000000"
         # Convert to RGB hex
-        r = (color >> 16) & 255
-        g = (color >> 8) & 255
-        b = color & 255
-        return f"#{r:02x}{g:02x}{b:02x}"
+        return "#" + _HEX_DIGITS[(color >> 16) & 255] + _HEX_DIGITS[(color >> 8) & 255] + _HEX_DIGITS[color & 255]
+    
+    @staticmethod
+    def image_stream_info(doc: fitz.Document, xref: int) -> Tuple[int, Optional[str]]:
+        """
+        Read an image's stored size and color space from its PDF dictionary.
+        
+        Nothing is decoded, so this is cheap even for large scanned images.
+        
+        Args:
+            doc: Open PyMuPDF document
+            xref: Image reference number
+            
+        Returns:
+            Tuple of (compressed stream length in bytes, color space name or None)
+        """
+        size_bytes = 0
+        length_type, length = doc.xref_get_key(xref, "Length")
+        if length_type == "xref":  # Indirect length object, e.g. "12 0 R"
+            length_type, length = "int", doc.xref_object(int(length.split()[0])).strip()
+        if length_type == "int" and length.isdigit():
+            size_bytes = int(length)
+        
+        colorspace_type, colorspace = doc.xref_get_key(xref, "ColorSpace")
+        colorspace_name = colorspace.lstrip("/") if colorspace_type == "name" else None
+        return size_bytes, colorspace_name
+    
+    @staticmethod
+    def span_style_ids(spans: List[Dict[str, Any]], styles: Dict[Tuple, int]) -> List[int]:
+        """
+        Look up the style id of every span, adding new styles to ``styles``.
+        
+        Args:
+            spans: Spans of one line from ``page.get_text("dict")``
+            styles: Style table mapping (font, size, flags, color, ascender, descender) to ids
+            
+        Returns:
+            List of style ids, indexed by span position
+        """
+        return [
+            styles.setdefault((span["font"], span["size"], span["flags"], span["color"],
+                               span["ascender"], span["descender"]), len(styles))
+            for span in spans
+        ]
+    
+    @staticmethod
+    def style_list(styles: Dict[Tuple, int]) -> List[Dict[str, Any]]:
+        """Convert a style table into the response ``styles`` list, ordered by id."""
+        return [
+            {
+                "id": style_id,
+                "font": font,
+                "size": size,
+                "flags": flags,
+                "font_properties": PDFProcessor.decode_font_flags(flags),
+                "color": color,
+                "color_hex": PDFProcessor.color_to_hex(color),
+                "ascender": ascender,
+                "descender": descender
+            }
+            for style_id, (font, size, flags, color, ascender, descender) in enumerate(styles)
+        ]
     
     @staticmethod
-    def extract_pdf_content(pdf_bytes: bytes) -> Dict[str, Any]:
+    def build_spans(spans: List[Dict[str, Any]],
+                    styles: Optional[Dict[Tuple, int]] = None) -> List[Dict[str, Any]]:
+        """
+        Convert PyMuPDF text spans into response span dicts.
+        
+        This runs once per span of the document, so lookups are bound to locals
+        and the result is built in a single comprehension.
+        
+        Args:
+            spans: Spans of one line from ``page.get_text("dict")``
+            styles: Style table; if given, font and color fields are replaced by a ``style_id``
+            
+        Returns:
+            List of span dicts with decoded font flags and hex colors
+        """
+        if styles is not None:
+            return [
+                {
+                    "bbox": span["bbox"],
+                    "text": span["text"],
+                    "style_id": style_id,
+                    "origin": span["origin"]
+                }
+                for span, style_id in zip(spans, PDFProcessor.span_style_ids(spans, styles))
+            ]
+        
+        flags_table = _FONT_FLAGS_TABLE
+        color_to_hex = PDFProcessor.color_to_hex
+        return [
+            {
+                "bbox": span["bbox"],
+                "text": span["text"],
+                "font": span["font"],
+                "size": span["size"],
+                "flags": span["flags"],  # Raw font flags
+                "font_properties": flags_table[span["flags"] & 0x1F],
+                "color": span["color"],  # Raw color value
+                "color_hex": color_to_hex(span["color"]),
+                "ascender": span["ascender"],
+                "descender": span["descender"],
+                "origin": span["origin"]  # Text origin point
+            }
+            for span in spans
+        ]
+    
+    @staticmethod
+    def build_span_columns(spans: List[Dict[str, Any]],
+                           styles: Optional[Dict[Tuple, int]] = None) -> Dict[str, List[Any]]:
+        """
+        Convert PyMuPDF text spans into per-field lists (structure of arrays).
+        
+        Omits ``font_properties`` and ``color_hex``, which clients can derive
+        from ``flags`` and ``color``.
+        
+        Args:
+            spans: Spans of one line from ``page.get_text("dict")``
+            styles: Style table; if given, font and color columns are replaced by ``style_ids``
+            
+        Returns:
+            Dictionary of equally long lists, indexed by span position
+        """
+        if styles is not None:
+            return {
+                "bboxes": [span["bbox"] for span in spans],
+                "texts": [span["text"] for span in spans],
+                "style_ids": PDFProcessor.span_style_ids(spans, styles),
+                "origins": [span["origin"] for span in spans]
+            }
+        
+        return {
+            "bboxes": [span["bbox"] for span in spans],
+            "texts": [span["text"] for span in spans],
+            "fonts": [span["font"] for span in spans],
+            "sizes": [span["size"] for span in spans],
+            "flags": [span["flags"] for span in spans],
+            "colors": [span["color"] for span in spans],
+            "ascenders": [span["ascender"] for span in spans],
+            "descenders": [span["descender"] for span in spans],
+            "origins": [span["origin"] for span in spans]
+        }
+    
+    @staticmethod
+    def extract_page(doc: fitz.Document, page_num: int,
+                     include_pixels: bool = False,
+                     span_format: str = "aos",
+                     include: frozenset = INCLUDE_SECTIONS,
+                     styles: Optional[Dict[Tuple, int]] = None) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        Extract text, layout and image information from a single page.
+        
+        Args:
+            doc: Open PyMuPDF document
+            page_num: 0-based page index
+            include_pixels: Decode every image to report its decoded pixel size
+            span_format: "aos" for a list of span dicts per line, "soa" for span columns
+            include: Sections to extract, a subset of ``INCLUDE_SECTIONS``
+            styles: Style table shared by all pages; spans then refer to styles by id
+            
+        Returns:
+            Tuple of (page_dict, list_of_image_info_dicts)
+        """
+        page = doc[page_num]
+        page_dict = {"page_number": page_num + 1}
+        
+        # Get text blocks with position and formatting
+        text_blocks = []
+        image_blocks = []
+        text_lines = []
+        blocks = page.get_text("dict") if "layout" in include else {}
+        
+        soa = span_format == "soa"
+        build_spans = PDFProcessor.build_span_columns if soa else PDFProcessor.build_spans
+        for block in blocks.get("blocks", []):
+            if block.get("type") == 1:  # Image block, used for positioning below
+                image_blocks.append(block)
+            elif "lines" in block:  # Text block
+                block_info = {
+                    "bbox": block["bbox"],  # [x0, y0, x1, y1]
+                    "block_type": "text",
+                    "lines": []
+                }
+                
+                for line in block["lines"]:
+                    spans = build_spans(line["spans"], styles)
+                    block_info["lines"].append({
+                        "bbox": line["bbox"],
+                        "wmode": line["wmode"],  # Writing mode
+                        "dir": line["dir"],  # Text direction
+                        "spans": spans
+                    })
+            
+                    # Same layout as page.get_text(): one line of span text per line
+                    text_lines.append("".join(spans["texts"] if soa else [span["text"] for span in spans]))
+                
+                text_blocks.append(block_info)
+        
+        if "text" in include:
+            if "layout" in include:
+                text = "\n".join(text_lines) + "\n" if text_lines else ""
+            else:
+                text = page.get_text()  # Fast path: plain text without the layout dict
+            page_dict["text"] = text.strip()
+            page_dict["char_count"] = len(text)
+        
+        # Get page dimensions
+        page_rect = page.rect
+        page_dict["page_dimensions"] = {
+            "width": page_rect.width,
+            "height": page_rect.height,
+            "rotation": page.rotation
+        }
+        
+        if "layout" in include:
+            page_dict["text_blocks"] = text_blocks
+        
+        # Extract images info with detailed positioning
+        page_images = []
+        if "images" not in include:
+            return page_dict, page_images
+        if "layout" not in include:
+            image_blocks = page.get_image_info()  # Image positions without parsing the text
+        image_list = page.get_images()
+        for img_index, img in enumerate(image_list):
+            # Basic image info from get_images()
+            img_info = {
+                "page_number": page_num + 1,
+                "image_index": img_index,
+                "xref": img[0],  # Image reference number
+                "smask": img[1],  # Soft mask reference
+                "width": img[2],
+                "height": img[3],
+                "bpc": img[4],  # Bits per component
+                "colorspace": img[5],  # Color space
+                "alt": img[6],  # Alternative text
+                "name": img[7],  # Image name
+                "filter": img[8],  # Compression filter
+                "bbox": [0, 0, 0, 0],  # Will be updated if found in blocks
+                "transform": None,  # Transformation matrix
+                "size_bytes": 0  # Image size in bytes
+            }
+            
+            # Try to get positioning from image blocks
+            if img_index < len(image_blocks):
+                img_block = image_blocks[img_index]
+                img_info["bbox"] = img_block.get("bbox", [0, 0, 0, 0])
+                img_info["transform"] = img_block.get("transform", None)
+            
+            if not include_pixels:
+                # Metadata only: stored size and color space, no decoding
+                size_bytes, colorspace_name = PDFProcessor.image_stream_info(doc, img[0])
+                img_info["actual_width"] = img[2]
+                img_info["actual_height"] = img[3]
+                img_info["colorspace_details"] = colorspace_name or img[5] or "Unknown"
+                img_info["size_bytes"] = size_bytes
+                page_images.append(img_info)
+                continue
+            
+            # Try to get actual image size
+            try:
+                pix = fitz.Pixmap(doc, img[0])
+                if pix.n - pix.alpha < 4:  # GRAY or RGB
+                    img_info["actual_width"] = pix.width
+                    img_info["actual_height"] = pix.height
+                    img_info["colorspace_details"] = pix.colorspace.name if pix.colorspace else "Unknown"
+                    img_info["size_bytes"] = len(pix.tobytes())
+                pix = None  # Clean up
+            except:
+                # If we can't get pixmap, use basic info
+                img_info["actual_width"] = img[2]
+                img_info["actual_height"] = img[3]
+            
+            page_images.append(img_info)
+        
+        return page_dict, page_images
+    
+    @staticmethod
+    def iter_pages(pdf_bytes: PDFBuffer, doc: fitz.Document,
+                   include_pixels: bool = False,
+                   span_format: str = "aos",
+                   include: frozenset = INCLUDE_SECTIONS,
+                   pages: Optional[List[int]] = None,
+                   styles: Optional[Dict[Tuple, int]] = None) -> Iterator[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        """
+        Extract the selected pages, in parallel worker processes for long documents.
+        
+        PyMuPDF cannot be used from several threads, so each worker process opens
+        its own copy of the document and handles a contiguous run of pages. Workers
+        build their own style tables, which are merged into ``styles`` here. If a
+        worker process dies, the pool is replaced and the remaining pages are
+        extracted serially.
+        
+        Args:
+            pdf_bytes: PDF file as bytes
+            doc: The same document, already open, used for short documents
+            include_pixels: Decode every image to report its decoded pixel size
+            span_format: "aos" or "soa", see ``extract_page``
+            include: Sections to extract, see ``extract_page``
+            pages: Sorted 0-based page indices to extract (default: all pages)
+            styles: Style table filled while pages are extracted, see ``extract_page``
+            
+        Yields:
+            Tuples of (page_dict, list_of_image_info_dicts) ordered by page number
+        """
+        page_numbers = list(range(doc.page_count)) if pages is None else pages
+        if PAGE_WORKERS < 2 or len(page_numbers) < PARALLEL_MIN_PAGES:
+            for page_num in page_numbers:
+                yield PDFProcessor.extract_page(doc, page_num, include_pixels, span_format, include, styles)
+            return
+        
+        if not isinstance(pdf_bytes, bytes):
+            pdf_bytes = bytes(pdf_bytes)  # Views of uploaded files cannot be sent to worker processes
+        chunk_size = -(-len(page_numbers) // PAGE_WORKERS)
+        chunks = deque(page_numbers[start:start + chunk_size] for start in range(0, len(page_numbers), chunk_size))
+        pool = get_page_pool()
+        
+        # Pop finished chunks and pages so that each page is released once consumed
+        try:
+            futures = deque(pool.submit(extract_page_range, pdf_bytes, chunk,
+                                        include_pixels, span_format, include, styles is not None)
+                            for chunk in chunks)
+            while futures:
+                results, chunk_styles = futures[0].result()
+                futures.popleft()
+                chunks.popleft()
+                if styles is not None:
+                    # Worker style ids are positions in its own table
+                    remap = [styles.setdefault(style, len(styles)) for style in chunk_styles]
+                    if remap != list(range(len(remap))):
+                        for page_dict, _ in results:
+                            PDFProcessor.remap_style_ids(page_dict, remap)
+                results = deque(results)
+                while results:
+                    yield results.popleft()
+        except BrokenProcessPool as e:
+            logger.error(f"Page worker process died, extracting the remaining pages serially: {str(e)}")
+            reset_page_pool(pool)
+            for chunk in chunks:
+                for page_num in chunk:
+                    yield PDFProcessor.extract_page(doc, page_num, include_pixels, span_format, include, styles)
+    
+    @staticmethod
+    def remap_style_ids(page_dict: Dict[str, Any], remap: List[int]) -> None:
+        """Replace the style ids in the spans of a page with ``remap[style_id]``."""
+        for block in page_dict.get("text_blocks", ()):
+            for line in block["lines"]:
+                spans = line["spans"]
+                if isinstance(spans, dict):  # Span columns
+                    spans["style_ids"] = [remap[style_id] for style_id in spans["style_ids"]]
+                else:
+                    for span in spans:
+                        span["style_id"] = remap[span["style_id"]]
+    
+    @staticmethod
+    def document_metadata(doc: fitz.Document) -> Dict[str, Any]:
+        """Return the document metadata in response format."""
+        metadata = doc.metadata or {}
+        return {
+            "title": metadata.get("title", ""),
+            "author": metadata.get("author", ""),
+            "subject": metadata.get("subject", ""),
+            "creator": metadata.get("creator", ""),
+            "producer": metadata.get("producer", ""),
+            "creation_date": metadata.get("creationDate", ""),
+            "modification_date": metadata.get("modDate", ""),
+            "page_count": doc.page_count
+        }
+    
+    @staticmethod
+    def parse_page_selection(spec: str, page_count: int) -> List[int]:
+        """
+        Parse a 1-based page selection such as ``"1-5,10"``.
+        
+        Args:
+            spec: Comma separated page numbers and inclusive ranges
+            page_count: Number of pages in the document
+            
+        Returns:
+            Sorted, de-duplicated 0-based page indices
+            
+        Raises:
+            ValueError: If the selection is malformed or outside the document
+        """
+        selected = set()
+        for part in spec.split(","):
+            part = part.strip()
+            if not part:
+                continue
+            first, separator, last = part.partition("-")
+            try:
+                start = int(first)
+                stop = int(last) if separator else start
+            except ValueError:
+                raise ValueError(f"Invalid page range '{part}'")
+            if start < 1 or stop > page_count or start > stop:
+                raise ValueError(f"Page range '{part}' is outside the document (pages 1-{page_count})")
+            selected.update(range(start - 1, stop))
+        
+        if not selected:
+            raise ValueError("No pages selected")
+        return sorted(selected)
+    
+    @staticmethod
+    def layout_info(span_format: str = "aos", include: frozenset = INCLUDE_SECTIONS,
+                    styles: bool = False) -> Dict[str, Any]:
+        """Return the description of the layout data for the given span format."""
+        decoded = span_format == "aos" or styles
+        return {
+            "has_positioning_data": "layout" in include,
+            "coordinate_system": "PDF coordinates (bottom-left origin)",
+            "bbox_format": "[x0, y0, x1, y1] where (x0,y0) is bottom-left, (x1,y1) is top-right",
+            "span_format": span_format,
+            "span_styles": styles,
+            "font_flags_decoded": decoded,
+            "color_format": "hex and integer values provided" if decoded else "integer values provided"
+        }
+    
+    @staticmethod
+    def extract_pdf_content(pdf_bytes: PDFBuffer, include_pixels: bool = False,
+                            include_full_text: bool = True, span_format: str = "aos",
+                            include: frozenset = INCLUDE_SECTIONS,
+                            pages: Optional[List[int]] = None,
+                            styles: bool = False) -> Dict[str, Any]:
         """
         Extract text and metadata from PDF bytes.
         
         Args:
             pdf_bytes: PDF file as bytes
+            include_pixels: Decode every image to report its decoded pixel size
+            include_full_text: Add the joined text of all pages as ``full_text``
+            span_format: "aos" or "soa", see ``extract_page``
+            include: Sections to extract, see ``extract_page``
+            pages: Sorted 0-based page indices to extract (default: all pages)
+            styles: Replace span font and color fields by ids into a top-level ``styles`` list
             
         Returns:
             Dictionary containing extracted content and metadata
@@ -81,156 +620,48 @@ class PDFProcessor:
             doc = fitz.open("pdf", pdf_bytes)
             
             # Extract metadata
-            metadata = doc.metadata
-            page_count = doc.page_count
+            metadata = PDFProcessor.document_metadata(doc)
             
-            # Extract text from all pages with detailed information
+            # Single pass over pages: text, layout and images share one parse
             pages_text = []
-            for page_num in range(page_count):
-                page = doc[page_num]
-                
-                # Get basic text
-                text = page.get_text()
-                
-                # Get text blocks with position and formatting
-                text_blocks = []
-                blocks = page.get_text("dict")
-                
-                for block in blocks.get("blocks", []):
-                    if "lines" in block:  # Text block
-                        block_info = {
-                            "bbox": block.get("bbox", [0, 0, 0, 0]),  # [x0, y0, x1, y1]
-                            "block_type": "text",
-                            "lines": []
-                        }
-                        
-                        for line in block["lines"]:
-                            line_info = {
-                                "bbox": line.get("bbox", [0, 0, 0, 0]),
-                                "wmode": line.get("wmode", 0),  # Writing mode
-                                "dir": line.get("dir", [1, 0]),  # Text direction
-                                "spans": []
-                            }
-                            
-                            for span in line.get("spans", []):
-                                span_info = {
-                                    "bbox": span.get("bbox", [0, 0, 0, 0]),
-                                    "text": span.get("text", ""),
-                                    "font": span.get("font", ""),
-                                    "size": span.get("size", 0),
-                                    "flags": span.get("flags", 0),  # Raw font flags
-                                    "font_properties": PDFProcessor.decode_font_flags(span.get("flags", 0)),
-                                    "color": span.get("color", 0),  # Raw color value
-                                    "color_hex": PDFProcessor.color_to_hex(span.get("color", 0)),
-                                    "ascender": span.get("ascender", 0),
-                                    "descender": span.get("descender", 0),
-                                    "origin": span.get("origin", [0, 0])  # Text origin point
-                                }
-                                line_info["spans"].append(span_info)
-                            
-                            block_info["lines"].append(line_info)
-                        
-                        text_blocks.append(block_info)
-                
-                # Get page dimensions
-                page_rect = page.rect
-                page_info = {
-                    "width": page_rect.width,
-                    "height": page_rect.height,
-                    "rotation": page.rotation
-                }
-                
-                pages_text.append({
-                    "page_number": page_num + 1,
-                    "text": text.strip(),
-                    "char_count": len(text),
-                    "page_dimensions": page_info,
-                    "text_blocks": text_blocks
-                })
-            
-            # Extract images info with detailed positioning
             images_info = []
-            for page_num in range(page_count):
-                page = doc[page_num]
-                image_list = page.get_images()
-                
-                # Get image blocks from text dict for positioning
-                blocks = page.get_text("dict")
-                image_blocks = [block for block in blocks.get("blocks", []) if block.get("type") == 1]
-                
-                for img_index, img in enumerate(image_list):
-                    # Basic image info from get_images()
-                    img_info = {
-                        "page_number": page_num + 1,
-                        "image_index": img_index,
-                        "xref": img[0],  # Image reference number
-                        "smask": img[1],  # Soft mask reference
-                        "width": img[2],
-                        "height": img[3],
-                        "bpc": img[4],  # Bits per component
-                        "colorspace": img[5],  # Color space
-                        "alt": img[6],  # Alternative text
-                        "name": img[7],  # Image name
-                        "filter": img[8],  # Compression filter
-                        "bbox": [0, 0, 0, 0],  # Will be updated if found in blocks
-                        "transform": None,  # Transformation matrix
-                        "size_bytes": 0  # Image size in bytes
-                    }
-                    
-                    # Try to get positioning from image blocks
-                    if img_index < len(image_blocks):
-                        img_block = image_blocks[img_index]
-                        img_info["bbox"] = img_block.get("bbox", [0, 0, 0, 0])
-                        img_info["transform"] = img_block.get("transform", None)
-                    
-                    # Try to get actual image size
-                    try:
-                        pix = fitz.Pixmap(doc, img[0])
-                        if pix.n - pix.alpha < 4:  # GRAY or RGB
-                            img_info["actual_width"] = pix.width
-                            img_info["actual_height"] = pix.height
-                            img_info["colorspace_details"] = pix.colorspace.name if pix.colorspace else "Unknown"
-                            img_info["size_bytes"] = len(pix.tobytes())
-                        pix = None  # Clean up
-                    except:
-                        # If we can't get pixmap, use basic info
-                        img_info["actual_width"] = img[2]
-                        img_info["actual_height"] = img[3]
-                    
-                    images_info.append(img_info)
+            full_text_parts = []
+            non_empty_pages = 0
+            total_chars = 0
+            style_table = {} if styles else None
+            for page_dict, page_images in PDFProcessor.iter_pages(pdf_bytes, doc, include_pixels, span_format,
+                                                                  include, pages, style_table):
+                pages_text.append(page_dict)
+                images_info.extend(page_images)
+                if page_dict.get("text"):
+                    non_empty_pages += 1
+                    total_chars += len(page_dict["text"])
+                    if include_full_text:
+                        full_text_parts.append(page_dict["text"])
             
             doc.close()
             
-            # Combine all text
-            full_text = "\n\n".join([page["text"] for page in pages_text if page["text"]])
+            # Length of the non-empty page texts joined with blank lines
+            total_chars += 2 * max(non_empty_pages - 1, 0)
             
-            return {
+            content = {
+                "pages": pages_text,
+                "total_chars": total_chars,
+                "images_count": len(images_info)
+            }
+            if include_full_text:
+                content = {"full_text": "\n\n".join(full_text_parts), **content}
+            
+            result = {
                 "success": True,
-                "metadata": {
-                    "title": metadata.get("title", ""),
-                    "author": metadata.get("author", ""),
-                    "subject": metadata.get("subject", ""),
-                    "creator": metadata.get("creator", ""),
-                    "producer": metadata.get("producer", ""),
-                    "creation_date": metadata.get("creationDate", ""),
-                    "modification_date": metadata.get("modDate", ""),
-                    "page_count": page_count
-                },
-                "content": {
-                    "full_text": full_text,
-                    "pages": pages_text,
-                    "total_chars": len(full_text),
-                    "images_count": len(images_info)
-                },
-                "images": images_info,
-                "layout_info": {
-                    "has_positioning_data": True,
-                    "coordinate_system": "PDF coordinates (bottom-left origin)",
-                    "bbox_format": "[x0, y0, x1, y1] where (x0,y0) is bottom-left, (x1,y1) is top-right",
-                    "font_flags_decoded": True,
-                    "color_format": "hex and integer values provided"
-                }
+                "metadata": metadata,
+                "content": content,
+                "images": images_info
             }
+            if styles:
+                result["styles"] = PDFProcessor.style_list(style_table)
+            result["layout_info"] = PDFProcessor.layout_info(span_format, include, styles)
+            return result
             
         except Exception as e:
             logger.error(f"Error processing PDF: {str(e)}")
@@ -240,60 +671,414 @@ class PDFProcessor:
             }
     
     @staticmethod
-    def extract_images_from_pdf(pdf_bytes: bytes) -> Tuple[Dict[str, Any], List[Tuple[str, bytes]]]:
+    def iter_pdf_content_json(pdf_bytes: PDFBuffer, doc: fitz.Document, include_pixels: bool = False,
+                              include_full_text: bool = True, span_format: str = "aos",
+                              include: frozenset = INCLUDE_SECTIONS,
+                              pages: Optional[List[int]] = None,
+                              styles: bool = False) -> Iterator[bytes]:
         """
-        Extract both content and images from PDF bytes.
+        Serialize the ``extract_pdf_content`` result incrementally, one page at a time.
+        
+        Each page is encoded as soon as it is extracted and then dropped, so only
+        one page's Python objects are alive at once. Totals, ``full_text``, the
+        image list and the style list are written after the pages, and
+        ``"success": true`` comes last. If extraction fails, the document is
+        closed with ``"success": false`` and the error instead, then the
+        exception is re-raised.
         
         Args:
             pdf_bytes: PDF file as bytes
+            doc: The same document, already open
+            include_pixels: Decode every image to report its decoded pixel size
+            include_full_text: Add the joined text of all pages as ``full_text``
+            span_format: "aos" or "soa", see ``extract_page``
+            include: Sections to extract, see ``extract_page``
+            pages: Sorted 0-based page indices to extract (default: all pages)
+            styles: Replace span font and color fields by ids into a top-level ``styles`` list
             
-        Returns:
-            Tuple of (content_dict, list_of_image_tuples)
-            where each image tuple is (filename, image_bytes)
+        Yields:
+            Consecutive chunks of one compact JSON document
         """
+        # Closing brackets of the containers opened so far, apart from the top-level object
+        close = None
         try:
-            doc = fitz.open("pdf", pdf_bytes)
-            images = []
+            yield b'{"metadata":' + orjson.dumps(PDFProcessor.document_metadata(doc))
+            close = b''
+            yield b',"content":{"pages":['
+            close = b']}'
             
-            # First extract normal content
-            content_result = PDFProcessor.extract_pdf_content(pdf_bytes)
-            
-            # Then extract actual image data
-            for page_num in range(doc.page_count):
-                page = doc[page_num]
-                image_list = page.get_images()
-                
-                for img_index, img in enumerate(image_list):
-                    try:
-                        # Get image data
-                        xref = img[0]
-                        pix = fitz.Pixmap(doc, xref)
-                        
-                        # Convert to PNG if needed
-                        if pix.n - pix.alpha < 4:  # GRAY or RGB
-                            img_data = pix.tobytes("png")
-                            img_filename = f"page_{page_num + 1}_image_{img_index + 1}.png"
-                            images.append((img_filename, img_data))
-                        
-                        pix = None  # Clean up
-                    except Exception as e:
-                        logger.warning(f"Could not extract image {img_index} from page {page_num + 1}: {e}")
+            images_info = []
+            full_text_parts = []
+            non_empty_pages = 0
+            total_chars = 0
+            separator = b''
+            style_table = {} if styles else None
+            for page_dict, page_images in PDFProcessor.iter_pages(pdf_bytes, doc, include_pixels, span_format,
+                                                                  include, pages, style_table):
+                images_info.extend(page_images)
+                if page_dict.get("text"):
+                    non_empty_pages += 1
+                    total_chars += len(page_dict["text"])
+                    if include_full_text:
+                        full_text_parts.append(page_dict["text"])
+                chunk = separator + orjson.dumps(page_dict)
+                del page_dict  # Not kept alive while the next page is extracted
+                yield chunk
+                separator = b','
             
-            doc.close()
-            return content_result, images
+            # Length of the non-empty page texts joined with blank lines
+            total_chars += 2 * max(non_empty_pages - 1, 0)
             
+            yield b']'
+            close = b'}'
+            if include_full_text:
+                yield b',"full_text":' + orjson.dumps("\n\n".join(full_text_parts))
+            yield b',"total_chars":' + orjson.dumps(total_chars)
+            yield b',"images_count":' + orjson.dumps(len(images_info))
+            yield b'},"images":' + orjson.dumps(images_info)
+            close = b''
+            if styles:
+                yield b',"styles":' + orjson.dumps(PDFProcessor.style_list(style_table))
+            yield (b',"layout_info":' + orjson.dumps(PDFProcessor.layout_info(span_format, include, styles))
+                   + b',"success":true}')
         except Exception as e:
-            logger.error(f"Error extracting images from PDF: {str(e)}")
-            return {
-                "success": False,
-                "error": f"Failed to extract images: {str(e)}"
-            }, []
+            # Complete the JSON document so that clients see the failure instead of a truncated body
+            error = orjson.dumps(f"Failed to process PDF: {str(e)}")
+            yield (b'{' if close is None else close + b',') + b'"success":false,"error":' + error + b'}'
+            raise
+    
+    @staticmethod
+    def iter_page_images(doc: fitz.Document) -> Iterator[Tuple[str, bytes]]:
+        """
+        Decode the images of every page to PNG, one image at a time.
+        
+        Images that cannot be decoded, or have more than three color components, are skipped.
+        
+        Args:
+            doc: Open PyMuPDF document
+            
+        Yields:
+            Tuples of (filename, png_bytes)
+        """
+        for page_num in range(doc.page_count):
+            page = doc[page_num]
+            image_list = page.get_images()
+            
+            for img_index, img in enumerate(image_list):
+                try:
+                    # Get image data
+                    xref = img[0]
+                    pix = fitz.Pixmap(doc, xref)
+                    
+                    # Convert to PNG if needed
+                    img_data = pix.tobytes("png") if pix.n - pix.alpha < 4 else None  # GRAY or RGB
+                    pix = None  # Clean up
+                except Exception as e:
+                    logger.warning(f"Could not extract image {img_index} from page {page_num + 1}: {e}")
+                    continue
+                
+                if img_data is not None:
+                    yield f"page_{page_num + 1}_image_{img_index + 1}.png", img_data
+
+# CORS headers sent with every response
+_CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type'
+}
+
+@app.hook('after_request')
+def add_cors_headers():
+    """Attach the CORS headers to the response."""
+    response.headers.update(_CORS_HEADERS)
+
+def query_flag(name: str) -> bool:
+    """Return True if query parameter ``name`` is set to a truthy value."""
+    return request.query.get(name, '').lower() in ('1', 'true', 'yes')
+
+_page_pool: Optional[ProcessPoolExecutor] = None
+_page_pool_lock = threading.Lock()
+
+def get_page_pool() -> ProcessPoolExecutor:
+    """Return the shared page extraction process pool, creating it on first use."""
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            # spawn: forking a threaded server process is not safe
+            _page_pool = ProcessPoolExecutor(max_workers=PAGE_WORKERS,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return _page_pool
+
+def reset_page_pool(broken: ProcessPoolExecutor) -> None:
+    """Drop a page pool whose worker process died, so that the next request starts a new one."""
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is broken:
+            _page_pool = None
+    broken.shutdown(wait=False)
+
+def extract_page_range(pdf_bytes: bytes, page_numbers: List[int],
+                       include_pixels: bool = False,
+                       span_format: str = "aos",
+                       include: frozenset = INCLUDE_SECTIONS,
+                       styles: bool = False) -> Tuple[List[Tuple[Dict[str, Any], List[Dict[str, Any]]]], List[Tuple]]:
+    """
+    Extract the given 0-based pages in a worker process with its own document.
+    
+    Returns the page results and, if ``styles`` is set, the styles they refer to in id order.
+    """
+    doc = fitz.open("pdf", pdf_bytes)
+    style_table = {} if styles else None
+    try:
+        results = [PDFProcessor.extract_page(doc, page_num, include_pixels, span_format, include, style_table)
+                   for page_num in page_numbers]
+        return results, list(style_table or ())
+    finally:
+        doc.close()
+
+class PDFUpload:
+    """
+    Uploaded PDF exposed as a zero-copy buffer.
+    
+    Uploads held in memory are viewed through ``BytesIO.getbuffer()``. Uploads
+    spooled to a temporary file are memory-mapped read-only, so the document is
+    not copied into a Python bytes object before MuPDF reads it. Close the upload
+    only after every document opened from ``data`` has been closed.
+    """
+    
+    def __init__(self, filename: str, file: Any):
+        """
+        Args:
+            filename: Original file name
+            file: File object holding the upload, positioned anywhere
+        """
+        self.filename = filename
+        self._mmap: Optional[mmap.mmap] = None
+        if isinstance(file, BytesIO):
+            self.data = file.getbuffer()
+            return
+        
+        try:
+            file.flush()
+            fileno = file.fileno()
+        except (AttributeError, OSError):
+            fileno = None
+        if fileno is not None and os.fstat(fileno).st_size > 0:
+            self._mmap = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+            self.data = memoryview(self._mmap)
+        else:
+            file.seek(0)
+            self.data = memoryview(file.read())
+    
+    def __len__(self) -> int:
+        return len(self.data)
+    
+    def close(self) -> None:
+        """Release the buffer and unmap the spooled file."""
+        self.data.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+    
+    def __enter__(self) -> "PDFUpload":
+        return self
+    
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+class CachedDocument:
+    """Open document together with the upload buffer MuPDF reads it from."""
+    
+    def __init__(self, doc: fitz.Document, upload: PDFUpload):
+        self.doc = doc
+        self.upload = upload
+        self.lock = threading.Lock()  # PyMuPDF documents must not be used by two threads at once
+        self.users = 0
+    
+    def iter_locked(self, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        """
+        Yield from ``chunks``, holding the document lock only while each chunk is produced.
+        
+        The lock is free while the consumer handles a chunk, so a slow client
+        does not block other requests for the same document.
+        """
+        chunks = iter(chunks)
+        while True:
+            with self.lock:
+                chunk = next(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    
+    def close(self) -> None:
+        """Close the document, then release the buffer it was opened from."""
+        self.doc.close()
+        self.upload.close()
+
+class DocumentCache:
+    """
+    Thread-safe LRU cache of open documents keyed by PDF content hash.
+    
+    Repeated requests for the same PDF skip parsing the xref table, fonts and
+    page tree again. A cached document owns the upload it was opened from, so the
+    buffer stays valid until the entry is evicted. Entries that are in use are
+    never evicted; they are closed once released if the cache is over its limits.
+    """
+    
+    def __init__(self, max_entries: int, max_bytes: int):
+        """
+        Args:
+            max_entries: Maximum number of open documents
+            max_bytes: Maximum total size of the PDFs behind the open documents
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[bytes, CachedDocument]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+    
+    def acquire(self, key: bytes, upload: PDFUpload) -> Tuple[CachedDocument, bool]:
+        """
+        Return the open document for ``key``, opening it from ``upload`` if needed.
+        
+        The returned entry stays open until it is passed to ``release``. Hold its
+        ``lock`` while using ``doc`` (see ``CachedDocument.iter_locked``).
+        
+        Args:
+            key: Content key of the PDF, see ``pdf_content_key``
+            upload: Upload holding the PDF
+            
+        Returns:
+            Tuple of the cache entry and whether the cache took ownership of ``upload``.
+            If it did not, the caller still has to close the upload.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.users += 1
+                return entry, False
+        
+        # Parse outside the cache lock so that lookups of other documents are not held up
+        doc = fitz.open("pdf", upload.data)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = CachedDocument(doc, upload)
+                self._entries[key] = entry
+                self._size += len(upload)
+                entry.users += 1
+                return entry, True
+            self._entries.move_to_end(key)
+            entry.users += 1
+        doc.close()  # Opened by another request in the meantime
+        return entry, False
+    
+    def release(self, entry: CachedDocument) -> None:
+        """Return an entry from ``acquire`` and evict documents over the limits."""
+        with self._lock:
+            entry.users -= 1
+            evicted = False
+            for key in list(self._entries):
+                if len(self._entries) <= self.max_entries and self._size <= self.max_bytes:
+                    break
+                candidate = self._entries[key]
+                if candidate.users:
+                    continue
+                del self._entries[key]
+                self._size -= len(candidate.upload)
+                candidate.close()
+                evicted = True
+            if evicted:
+                # Return memory held by MuPDF's object store for the closed documents
+                fitz.TOOLS.store_shrink(100)
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+document_cache = DocumentCache(DOCUMENT_CACHE_ENTRIES, DOCUMENT_CACHE_MB * 1024 * 1024)
+
+def read_pdf_upload() -> PDFUpload:
+    """
+    Read the uploaded PDF from the current request.
+    
+    Accepts either a raw ``application/pdf`` body (optional ``filename`` query
+    parameter) or multipart/form-data with the PDF in the ``file`` field.
+    
+    Returns:
+        PDFUpload with the file name and a buffer of the PDF content
+    """
+    if request.content_type.split(';')[0].strip().lower() == 'application/pdf':
+        # Raw body: no multipart parsing and no extra copy of the document
+        filename = request.query.get('filename') or 'document.pdf'
+        body = request.body
+    else:
+        upload = request.files.get('file')
+        if not upload:
+            raise HTTPError(400, "No file uploaded. Please provide a PDF file in 'file' field.")
+        filename = upload.filename
+        body = upload.file
+    
+    # Validate file type
+    if not filename.lower().endswith('.pdf'):
+        raise HTTPError(400, "Invalid file type. Only PDF files are supported.")
+    
+    # Map file content
+    upload = PDFUpload(filename, body)
+    if not len(upload):
+        upload.close()
+        raise HTTPError(400, "Empty file uploaded.")
+    
+    return upload
+
+def stream_extract_response(chunks: Iterator[bytes], filename: str, cache_key: bytes,
+                            setup_ms: float, on_close: Callable[[], None]) -> Iterator[bytes]:
+    """
+    Pass the JSON chunks of an extraction through to the client.
+    
+    Calls ``on_close`` when done and stores the complete body in the result
+    cache if producing it took at least the cache's ``min_duration_ms``. Only
+    the time spent producing chunks counts, not the time spent sending them to
+    the client. Chunks are kept only up to the cache's entry size limit; a body
+    that turns out to be too fast to cache is small, since little output is
+    produced within the threshold.
+    
+    The status line has already been sent, so an error while streaming is only
+    logged here; ``iter_pdf_content_json`` has already ended the body with
+    ``"success": false`` and the error. Failed results are not cached.
+    """
+    collected: Optional[List[bytes]] = [] if result_cache.max_entries > 0 else None
+    collected_size = 0
+    extraction_ms = setup_ms
+    chunks = iter(chunks)
+    try:
+        while True:
+            started = time.perf_counter()
+            chunk = next(chunks, None)
+            extraction_ms += (time.perf_counter() - started) * 1000
+            if chunk is None:
+                break
+            if collected is not None:
+                collected_size += len(chunk)
+                if collected_size <= result_cache.max_entry_bytes:
+                    collected.append(chunk)
+                else:
+                    collected = None  # Too large to cache, stop keeping a copy
+            yield chunk
+        
+        logger.info(f"Successfully processed PDF: {filename}")
+        if collected is not None:
+            result_cache.put(cache_key, b''.join(collected), extraction_ms)
+    except Exception as e:
+        logger.error(f"Failed to process PDF while streaming: {filename}: {str(e)}")
+    finally:
+        on_close()
 
 @app.route('/health', method='GET')
 def health_check():
     """Health check endpoint."""
     response.headers['Content-Type'] = 'application/json'
-    return json.dumps({
+    return orjson.dumps({
         "status": "healthy",
         "service": "pdf-processor",
         "version": "1.0.0"
@@ -304,108 +1089,145 @@ def extract_pdf():
     """
     Extract content from uploaded PDF file.
     
-    Expected: multipart/form-data with 'file' field containing PDF
+    Expected: raw application/pdf body, or multipart/form-data with 'file' field containing PDF
     Returns: JSON with extracted content and metadata
     """
+    upload = None
     try:
-        # Set CORS headers
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
         response.headers['Content-Type'] = 'application/json'
         
         # Get uploaded file
-        upload = request.files.get('file')
-        if not upload:
-            raise HTTPError(400, "No file uploaded. Please provide a PDF file in 'file' field.")
+        upload = read_pdf_upload()
+        filename, pdf_bytes = upload.filename, upload.data
         
-        # Validate file type
-        if not upload.filename.lower().endswith('.pdf'):
-            raise HTTPError(400, "Invalid file type. Only PDF files are supported.")
+        include_pixels = query_flag('include_pixels')
+        include_full_text = query_flag('include_full_text')
+        span_format = request.query.get('format') or 'aos'
+        if span_format not in SPAN_FORMATS:
+            raise HTTPError(400, f"Invalid format '{span_format}'. Supported formats: {', '.join(SPAN_FORMATS)}.")
+        include = frozenset(part.strip() for part in request.query.get('include', '').split(',') if part.strip())
+        if include - INCLUDE_SECTIONS:
+            raise HTTPError(400, f"Invalid include '{request.query.get('include')}'. "
+                                 f"Supported sections: {', '.join(sorted(INCLUDE_SECTIONS))}.")
+        include = include or INCLUDE_SECTIONS
+        page_spec = request.query.get('pages', '').strip()
+        styles = query_flag('styles')
         
-        # Read file content
-        pdf_bytes = upload.file.read()
-        if not pdf_bytes:
-            raise HTTPError(400, "Empty file uploaded.")
+        # Same PDF with the same options: reuse the serialized result
+        content_key = pdf_content_key(pdf_bytes)
+        cache_key = ResultCache.make_key(content_key, include_pixels, include_full_text, span_format,
+                                         sorted(include), page_spec, styles)
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Serving cached result for PDF: {filename} ({len(pdf_bytes)} bytes)")
+            return cached
         
-        logger.info(f"Processing PDF: {upload.filename} ({len(pdf_bytes)} bytes)")
+        logger.info(f"Processing PDF: {filename} ({len(pdf_bytes)} bytes)")
         
-        # Process PDF
-        result = PDFProcessor.extract_pdf_content(pdf_bytes)
+        # Open before streaming so that unreadable PDFs still get a complete error body
+        started = time.perf_counter()
+        try:
+            entry, adopted = document_cache.acquire(content_key, upload)
+        except Exception as e:
+            logger.error(f"Failed to process PDF: {filename}: {str(e)}")
+            return orjson.dumps({
+                "success": False,
+                "error": f"Failed to process PDF: {str(e)}"
+            })
         
-        if result["success"]:
-            logger.info(f"Successfully processed PDF: {upload.filename}")
-        else:
-            logger.error(f"Failed to process PDF: {upload.filename}")
+        # A new document keeps its upload; otherwise ours is closed with the response
+        request_upload = None if adopted else upload
+        upload = None
+        
+        def finish() -> None:
+            document_cache.release(entry)
+            if request_upload is not None:
+                request_upload.close()
+        
+        doc = entry.doc
+        pages = None
+        if page_spec:
+            try:
+                with entry.lock:
+                    page_count = doc.page_count
+                pages = PDFProcessor.parse_page_selection(page_spec, page_count)
+            except ValueError as e:
+                finish()
+                raise HTTPError(400, f"Invalid pages '{page_spec}': {str(e)}.")
         
-        return json.dumps(result, indent=2)
+        # Process PDF, sending each page as soon as it is extracted. The document is
+        # only locked while a chunk is produced, not while it is sent to the client.
+        chunks = PDFProcessor.iter_pdf_content_json(pdf_bytes, doc,
+                                                    include_pixels=include_pixels,
+                                                    include_full_text=include_full_text,
+                                                    span_format=span_format,
+                                                    include=include,
+                                                    pages=pages,
+                                                    styles=styles)
+        setup_ms = (time.perf_counter() - started) * 1000
+        return stream_extract_response(entry.iter_locked(chunks), filename, cache_key, setup_ms, finish)
         
     except HTTPError:
         raise
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPError(500, f"Internal server error: {str(e)}")
+    finally:
+        if upload is not None:
+            upload.close()
 
 @app.route('/extract/zip', method='POST')
 def extract_pdf_with_images():
     """
     Extract content and images from uploaded PDF file, return as ZIP.
     
-    Expected: multipart/form-data with 'file' field containing PDF
+    Expected: raw application/pdf body, or multipart/form-data with 'file' field containing PDF
     Returns: ZIP file containing JSON analysis and extracted images
     """
+    upload = None
     try:
-        # Set CORS headers
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
-        
         # Get uploaded file
-        upload = request.files.get('file')
-        if not upload:
-            raise HTTPError(400, "No file uploaded. Please provide a PDF file in 'file' field.")
+        upload = read_pdf_upload()
+        filename, pdf_bytes = upload.filename, upload.data
         
-        # Validate file type
-        if not upload.filename.lower().endswith('.pdf'):
-            raise HTTPError(400, "Invalid file type. Only PDF files are supported.")
+        logger.info(f"Processing PDF with images: {filename} ({len(pdf_bytes)} bytes)")
         
-        # Read file content
-        pdf_bytes = upload.file.read()
-        if not pdf_bytes:
-            raise HTTPError(400, "Empty file uploaded.")
-        
-        logger.info(f"Processing PDF with images: {upload.filename} ({len(pdf_bytes)} bytes)")
-        
-        # Extract content and images
-        content_result, images = PDFProcessor.extract_images_from_pdf(pdf_bytes)
-        
-        if not content_result["success"]:
-            raise HTTPError(500, content_result.get("error", "Failed to process PDF"))
+        try:
+            doc = fitz.open("pdf", pdf_bytes)
+        except Exception as e:
+            logger.error(f"Error extracting images from PDF: {str(e)}")
+            raise HTTPError(500, f"Failed to process PDF: {str(e)}")
         
         # Create ZIP file in memory
         zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            # Add JSON analysis
-            json_content = json.dumps(content_result, indent=2, ensure_ascii=False)
-            json_filename = f"{Path(upload.filename).stem}_analysis.json"
-            zip_file.writestr(json_filename, json_content.encode('utf-8'))
-            
-            # Add extracted images
-            if images:
-                for img_filename, img_data in images:
+        try:
+            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+                # Add JSON analysis, compressed page by page as it is extracted
+                json_filename = f"{Path(filename).stem}_analysis.json"
+                with zip_file.open(json_filename, 'w') as json_file:
+                    for chunk in PDFProcessor.iter_pdf_content_json(pdf_bytes, doc):
+                        json_file.write(chunk)
+                
+                # Add extracted images
+                images_count = 0
+                for img_filename, img_data in PDFProcessor.iter_page_images(doc):
                     zip_file.writestr(f"images/{img_filename}", img_data)
-                logger.info(f"Added {len(images)} images to ZIP")
-            else:
-                # Add empty folder to indicate no images
-                zip_file.writestr("images/.gitkeep", "")
+                    images_count += 1
+                if images_count:
+                    logger.info(f"Added {images_count} images to ZIP")
+                else:
+                    # Add empty folder to indicate no images
+                    zip_file.writestr("images/.gitkeep", "")
+        finally:
+            doc.close()
         
         zip_buffer.seek(0)
         
         # Set response headers for ZIP file
         response.headers['Content-Type'] = 'application/zip'
-        response.headers['Content-Disposition'] = f'attachment; filename="{Path(upload.filename).stem}_content.zip"'
+        response.headers['Content-Disposition'] = f'attachment; filename="{Path(filename).stem}_content.zip"'
         
-        logger.info(f"Successfully created ZIP for PDF: {upload.filename}")
+        logger.info(f"Successfully created ZIP for PDF: {filename}")
         return zip_buffer.getvalue()
         
     except HTTPError:
@@ -413,28 +1235,34 @@ def extract_pdf_with_images():
     except Exception as e:
         logger.error(f"Unexpected error in ZIP endpoint: {str(e)}")
         raise HTTPError(500, f"Internal server error: {str(e)}")
+    finally:
+        if upload is not None:
+            upload.close()
 
 @app.route('/extract/zip', method='OPTIONS')
 def extract_pdf_zip_options():
-    """Handle CORS preflight for ZIP endpoint."""
-    response.headers['Access-Control-Allow-Origin'] = '*'
-    response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    """Handle CORS preflight for ZIP endpoint (headers added by add_cors_headers)."""
     return {}
 
 @app.route('/extract', method='OPTIONS')
 def extract_pdf_options():
-    """Handle preflight CORS requests."""
-    response.headers['Access-Control-Allow-Origin'] = '*'
-    response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    """Handle preflight CORS requests (headers added by add_cors_headers)."""
     return {}
 
+@app.error(400)
+def bad_request(error):
+    """Handle 400 errors."""
+    response.headers['Content-Type'] = 'application/json'
+    return orjson.dumps({
+        "error": "Bad request",
+        "message": error.body
+    })
+
 @app.error(404)
 def not_found(error):
     """Handle 404 errors."""
     response.headers['Content-Type'] = 'application/json'
-    return json.dumps({
+    return orjson.dumps({
         "error": "Endpoint not found",
         "available_endpoints": [
             "GET /health - Health check",
@@ -447,22 +1275,52 @@ def not_found(error):
 def server_error(error):
     """Handle 500 errors."""
     response.headers['Content-Type'] = 'application/json'
-    return json.dumps({
+    return orjson.dumps({
         "error": "Internal server error",
         "message": str(error)
     })
 
+def create_app() -> Bottle:
+    """Application factory used by WSGI servers (e.g. ``gunicorn 'main:create_app()'``)."""
+    return app
+
+def main_dev(host: str, port: int):
+    """Run the single-process development server with debug pages and auto-reload."""
+    try:
+        import paste  # noqa: F401
+    except ImportError:
+        # wsgiref ships with Python and also handles one request at a time
+        logger.warning("Paste is not installed (pip install -r requirements-dev.txt), using wsgiref")
+        run(create_app(), server='wsgiref', host=host, port=port, debug=True, reloader=True)
+        return
+    
+    # One request thread: PyMuPDF must not be called from several threads at once
+    run(create_app(), server='paste', host=host, port=port, debug=True, reloader=True,
+        use_threadpool=True, threadpool_workers=1)
+
+def main_prod(host: str, port: int):
+    """Run the app under gunicorn without debug tracebacks or the reloader."""
+    debug(False)
+    # One process per core, one request at a time per process: PyMuPDF is not thread-safe,
+    # so concurrent requests must not share a process
+    logger.info(f"Using gunicorn with {WORKERS} sync workers x {PAGE_WORKERS} page workers")
+    run(create_app(), server='gunicorn', host=host, port=port,
+        workers=WORKERS, worker_class='sync', timeout=WORKER_TIMEOUT)
+
 def main():
     """Main function to start the server."""
     port = int(os.getenv('PORT', 3095))
     host = os.getenv('HOST', '0.0.0.0')
-    debug = os.getenv('DEBUG', 'false').lower() == 'true'
+    debug_mode = os.getenv('DEBUG', 'false').lower() == 'true'
     
     logger.info(f"Starting PDF Processor Service on {host}:{port}")
-    logger.info(f"Debug mode: {debug}")
+    logger.info(f"Debug mode: {debug_mode}")
     
     try:
-        run(app, host=host, port=port, debug=debug, reloader=debug)
+        if debug_mode:
+            main_dev(host, port)
+        else:
+            main_prod(host, port)
     except KeyboardInterrupt:
         logger.info("Server stopped by user")
     except Exception as e:
@@ -1,8 +1,57 @@
 """Tests for PDF processor service."""
+import fitz
 import pytest
 from main import PDFProcessor
 
 
+def make_pdf(page_count=2):
+    """Build a small in-memory PDF with two text lines per page."""
+    doc = fitz.open()
+    for page_num in range(page_count):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Page {page_num + 1} heading", fontsize=16)
+        page.insert_text((72, 100), "Body text", fontsize=11, color=(1, 0, 0))
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return pdf_bytes
+
+
+def make_image_pdf():
+    """Build a one-page PDF containing a single 10x8 RGB image."""
+    doc = fitz.open()
+    page = doc.new_page()
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 10, 8), False)
+    pix.clear_with(200)
+    page.insert_image(fitz.Rect(72, 72, 172, 152), pixmap=pix)
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return pdf_bytes
+
+
+def call_app(method, path, query="", body=b"", content_type="application/pdf"):
+    """Send a request through the WSGI app and return (status, headers, body)."""
+    from io import BytesIO
+    from wsgiref.util import setup_testing_defaults
+    from main import app
+
+    environ = {
+        "REQUEST_METHOD": method,
+        "PATH_INFO": path,
+        "QUERY_STRING": query,
+        "CONTENT_TYPE": content_type,
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": BytesIO(body),
+    }
+    setup_testing_defaults(environ)
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"], started["headers"] = status, dict(headers)
+
+    response_body = b"".join(app(environ, start_response))
+    return started["status"], started["headers"], response_body
+
+
 def test_decode_font_flags():
     """Test font flags decoding."""
     flags = 16  # Bold flag
@@ -11,6 +60,14 @@ def test_decode_font_flags():
     assert result["italic"] is False
 
 
+def test_decode_font_flags_ignores_unknown_bits():
+    """Bits above the five decoded flags do not change the result."""
+    result = PDFProcessor.decode_font_flags(2 | 16 | 32)
+    assert result == PDFProcessor.decode_font_flags(2 | 16)
+    assert result["italic"] is True
+    assert result["bold"] is True
+
+
 def test_color_to_hex():
     """Test color conversion."""
     # Black color
@@ -19,3 +76,419 @@ def test_color_to_hex():
     # White color (assuming RGB)
     white = (255 << 16) | (255 << 8) | 255
     assert PDFProcessor.color_to_hex(white) == "#ffffff"
+
+
+def test_page_text_matches_plain_text_extraction():
+    """Page text built from the layout dict matches page.get_text()."""
+    pdf_bytes = make_pdf()
+    result = PDFProcessor.extract_pdf_content(pdf_bytes)
+    assert result["success"] is True
+
+    doc = fitz.open("pdf", pdf_bytes)
+    for page, page_result in zip(doc, result["content"]["pages"]):
+        expected = page.get_text()
+        assert page_result["text"] == expected.strip()
+        assert page_result["char_count"] == len(expected)
+    doc.close()
+
+
+def test_image_metadata_without_decoding():
+    """Image size and color space come from the PDF dictionary by default."""
+    result = PDFProcessor.extract_pdf_content(make_image_pdf())
+    image = result["images"][0]
+    assert image["actual_width"] == 10
+    assert image["actual_height"] == 8
+    assert image["colorspace_details"] == image["colorspace"]
+    assert image["size_bytes"] > 0
+    assert image["bbox"] == pytest.approx([72, 72, 172, 152])
+
+
+def test_image_metadata_with_pixels():
+    """include_pixels decodes the image through a pixmap."""
+    result = PDFProcessor.extract_pdf_content(make_image_pdf(), include_pixels=True)
+    image = result["images"][0]
+    assert image["actual_width"] == 10
+    assert "RGB" in image["colorspace_details"]
+    assert image["size_bytes"] > 0
+
+
+def test_parallel_page_extraction_matches_serial(monkeypatch):
+    """Pages extracted in worker processes equal the serial result, in order."""
+    import main
+
+    pdf_bytes = make_pdf(page_count=5)
+    serial = PDFProcessor.extract_pdf_content(pdf_bytes)
+
+    monkeypatch.setattr(main, "PAGE_WORKERS", 2)
+    monkeypatch.setattr(main, "PARALLEL_MIN_PAGES", 2)
+    parallel = PDFProcessor.extract_pdf_content(pdf_bytes)
+
+    assert parallel == serial
+    assert [page["page_number"] for page in parallel["content"]["pages"]] == [1, 2, 3, 4, 5]
+
+
+def test_read_pdf_upload_accepts_raw_body():
+    """A raw application/pdf body is read without multipart parsing."""
+    from io import BytesIO
+    from bottle import request
+    from main import read_pdf_upload
+
+    pdf_bytes = make_pdf(page_count=1)
+    request.bind({
+        "REQUEST_METHOD": "POST",
+        "CONTENT_TYPE": "application/pdf",
+        "CONTENT_LENGTH": str(len(pdf_bytes)),
+        "QUERY_STRING": "filename=manual.pdf",
+        "wsgi.input": BytesIO(pdf_bytes),
+    })
+    with read_pdf_upload() as upload:
+        assert upload.filename == "manual.pdf"
+        assert upload.data == pdf_bytes
+
+
+def test_spooled_upload_is_memory_mapped():
+    """Uploads spooled to a temporary file are mapped instead of read."""
+    import tempfile
+    from main import PDFUpload
+
+    pdf_bytes = make_pdf(page_count=2)
+    with tempfile.TemporaryFile() as spooled:
+        spooled.write(pdf_bytes)
+        with PDFUpload("spooled.pdf", spooled) as upload:
+            assert upload._mmap is not None
+            doc = fitz.open("pdf", upload.data)
+            assert doc.page_count == 2
+            doc.close()
+        assert upload._mmap is None
+
+
+def test_full_text_is_optional():
+    """total_chars is the same whether or not full_text is built."""
+    pdf_bytes = make_pdf(page_count=3)
+    with_text = PDFProcessor.extract_pdf_content(pdf_bytes)
+    without_text = PDFProcessor.extract_pdf_content(pdf_bytes, include_full_text=False)
+
+    full_text = with_text["content"]["full_text"]
+    assert full_text == "\n\n".join(page["text"] for page in with_text["content"]["pages"])
+    assert "full_text" not in without_text["content"]
+    assert without_text["content"]["total_chars"] == with_text["content"]["total_chars"] == len(full_text)
+
+
+def test_result_cache_evicts_least_recently_used():
+    """The cache keeps at most max_entries / max_bytes and skips fast results."""
+    from main import ResultCache
+
+    cache = ResultCache(max_entries=2, max_bytes=10, min_duration_ms=5)
+    keys = [ResultCache.make_key(b"pdf", n) for n in range(3)]
+    assert len(set(keys)) == 3
+
+    cache.put(keys[0], b"aaaa", duration_ms=10)
+    cache.put(keys[1], b"bbbb", duration_ms=10)
+    assert cache.get(keys[0]) == b"aaaa"  # keys[1] is now least recently used
+    cache.put(keys[2], b"cccc", duration_ms=10)
+    assert cache.get(keys[1]) is None
+    assert len(cache) == 2
+
+    cache.put(keys[1], b"bbbbbbbb", duration_ms=10)  # over max_bytes with the others
+    assert len(cache) == 1
+    assert cache.get(keys[1]) == b"bbbbbbbb"
+
+    cache.put(keys[0], b"a", duration_ms=1)  # too fast to be worth caching
+    assert cache.get(keys[0]) is None
+
+
+def test_document_cache_reuses_open_documents():
+    """Documents are shared per content key and closed once evicted and released."""
+    from io import BytesIO
+    from main import DocumentCache, PDFUpload, pdf_content_key
+
+    pdf_bytes = make_pdf()
+    cache = DocumentCache(max_entries=1, max_bytes=10 * len(pdf_bytes))
+
+    first, adopted = cache.acquire(pdf_content_key(pdf_bytes), PDFUpload("a.pdf", BytesIO(pdf_bytes)))
+    assert adopted
+    cache.release(first)
+
+    upload = PDFUpload("a.pdf", BytesIO(pdf_bytes))
+    second, adopted = cache.acquire(pdf_content_key(pdf_bytes), upload)
+    assert not adopted and second is first
+    upload.close()
+
+    other_bytes = make_pdf(page_count=3)
+    other, adopted = cache.acquire(pdf_content_key(other_bytes), PDFUpload("b.pdf", BytesIO(other_bytes)))
+    assert len(cache) == 2
+    cache.release(first)
+    assert len(cache) == 1  # first was least recently used and is no longer in use
+    assert first.doc.is_closed
+
+    upload = PDFUpload("c.pdf", BytesIO(pdf_bytes))
+    third, adopted = cache.acquire(pdf_content_key(pdf_bytes), upload)
+    cache.release(other)
+    assert other.doc.is_closed  # over the limit while third is in use
+    assert not third.doc.is_closed and third.doc.page_count == 2
+    cache.release(third)
+    assert len(cache) == 1
+
+
+def test_soa_span_format_matches_span_dicts():
+    """format=soa carries the same span values as the default layout."""
+    pdf_bytes = make_pdf(page_count=1)
+    aos = PDFProcessor.extract_pdf_content(pdf_bytes)
+    soa = PDFProcessor.extract_pdf_content(pdf_bytes, span_format="soa")
+
+    aos_page = aos["content"]["pages"][0]
+    soa_page = soa["content"]["pages"][0]
+    assert soa_page["text"] == aos_page["text"]
+    for aos_block, soa_block in zip(aos_page["text_blocks"], soa_page["text_blocks"]):
+        for aos_line, soa_line in zip(aos_block["lines"], soa_block["lines"]):
+            columns = soa_line["spans"]
+            assert columns["texts"] == [span["text"] for span in aos_line["spans"]]
+            assert columns["colors"] == [span["color"] for span in aos_line["spans"]]
+            assert columns["bboxes"] == [span["bbox"] for span in aos_line["spans"]]
+    assert soa["layout_info"]["span_format"] == "soa"
+
+
+def test_streamed_json_matches_extracted_content():
+    """The incrementally written JSON decodes to the extract_pdf_content result."""
+    import orjson
+
+    pdf_bytes = make_pdf(page_count=3)
+    doc = fitz.open("pdf", pdf_bytes)
+    chunks = list(PDFProcessor.iter_pdf_content_json(pdf_bytes, doc))
+    styled_chunks = list(PDFProcessor.iter_pdf_content_json(pdf_bytes, doc, styles=True))
+    doc.close()
+
+    assert len(chunks) > 3
+    expected = orjson.loads(orjson.dumps(PDFProcessor.extract_pdf_content(pdf_bytes)))  # tuples -> lists
+    assert orjson.loads(b"".join(chunks)) == expected
+    expected = orjson.loads(orjson.dumps(PDFProcessor.extract_pdf_content(pdf_bytes, styles=True)))
+    assert orjson.loads(b"".join(styled_chunks)) == expected
+
+
+def test_parse_page_selection():
+    """Page selections are 1-based, inclusive and returned as sorted 0-based indices."""
+    assert PDFProcessor.parse_page_selection("1-3,10, 2", 10) == [0, 1, 2, 9]
+    for spec in ("0", "11", "3-2", "a", "1-", ","):
+        with pytest.raises(ValueError):
+            PDFProcessor.parse_page_selection(spec, 10)
+
+
+def test_selected_pages_and_sections():
+    """Only the selected pages and sections are extracted."""
+    pdf_bytes = make_pdf(page_count=4)
+    full = PDFProcessor.extract_pdf_content(pdf_bytes)
+    text_only = PDFProcessor.extract_pdf_content(pdf_bytes, include=frozenset({"text"}), pages=[1, 3])
+
+    pages = text_only["content"]["pages"]
+    assert [page["page_number"] for page in pages] == [2, 4]
+    assert "text_blocks" not in pages[0]
+    assert pages[0]["text"] == full["content"]["pages"][1]["text"]
+    assert text_only["layout_info"]["has_positioning_data"] is False
+
+    images_only = PDFProcessor.extract_pdf_content(make_image_pdf(), include=frozenset({"images"}))
+    assert "text" not in images_only["content"]["pages"][0]
+    assert images_only["images"][0]["bbox"] == pytest.approx([72, 72, 172, 152])
+
+
+@pytest.mark.parametrize("span_format", ["aos", "soa"])
+def test_span_styles_match_span_fields(monkeypatch, span_format):
+    """Style ids resolve to the span fields, also when merged from parallel workers."""
+    import main
+
+    doc = fitz.open()
+    for page_num in range(4):
+        page = doc.new_page()
+        page.insert_text((72, 72), "Shared style", fontsize=11)
+        page.insert_text((72, 100), f"Page {page_num + 1} style", fontsize=12 + page_num)
+    pdf_bytes = doc.tobytes()
+    doc.close()
+
+    plain = PDFProcessor.extract_pdf_content(pdf_bytes)
+    monkeypatch.setattr(main, "PAGE_WORKERS", 2)
+    monkeypatch.setattr(main, "PARALLEL_MIN_PAGES", 2)
+    styled = PDFProcessor.extract_pdf_content(pdf_bytes, span_format=span_format, styles=True)
+
+    styles = styled["styles"]
+    assert [style["id"] for style in styles] == list(range(5))
+    for plain_page, styled_page in zip(plain["content"]["pages"], styled["content"]["pages"]):
+        for plain_block, styled_block in zip(plain_page["text_blocks"], styled_page["text_blocks"]):
+            for plain_line, styled_line in zip(plain_block["lines"], styled_block["lines"]):
+                spans = styled_line["spans"]
+                style_ids = spans["style_ids"] if span_format == "soa" else [span["style_id"] for span in spans]
+                for span, style_id in zip(plain_line["spans"], style_ids):
+                    style = styles[style_id]
+                    assert {field: span[field] for field in style if field != "id"} == \
+                        {field: value for field, value in style.items() if field != "id"}
+    assert styled["layout_info"]["span_styles"] is True
+
+
+def test_zip_contains_streamed_analysis_and_images():
+    """The ZIP holds the extraction result as JSON and every image as PNG."""
+    import zipfile
+    from io import BytesIO
+    import orjson
+    from bottle import request
+    from main import extract_pdf_with_images
+
+    pdf_bytes = make_image_pdf()
+    request.bind({
+        "REQUEST_METHOD": "POST",
+        "CONTENT_TYPE": "application/pdf",
+        "CONTENT_LENGTH": str(len(pdf_bytes)),
+        "QUERY_STRING": "filename=manual.pdf",
+        "wsgi.input": BytesIO(pdf_bytes),
+    })
+    with zipfile.ZipFile(BytesIO(extract_pdf_with_images())) as archive:
+        assert sorted(archive.namelist()) == ["images/page_1_image_1.png", "manual_analysis.json"]
+        expected = orjson.loads(orjson.dumps(PDFProcessor.extract_pdf_content(pdf_bytes)))
+        assert orjson.loads(archive.read("manual_analysis.json")) == expected
+        assert archive.read("images/page_1_image_1.png").startswith(b"\x89PNG")
+
+
+def test_broken_page_pool_falls_back_to_serial(monkeypatch):
+    """A dead page worker does not fail the request and the pool is replaced."""
+    from concurrent.futures import Future
+    from concurrent.futures.process import BrokenProcessPool
+    import main
+
+    class BrokenPool:
+        def submit(self, *args):
+            future = Future()
+            future.set_exception(BrokenProcessPool("A child process terminated abruptly"))
+            return future
+
+        def shutdown(self, wait=True):
+            self.shut_down = True
+
+    pdf_bytes = make_pdf(page_count=4)
+    serial = PDFProcessor.extract_pdf_content(pdf_bytes)
+
+    broken = BrokenPool()
+    monkeypatch.setattr(main, "PAGE_WORKERS", 2)
+    monkeypatch.setattr(main, "PARALLEL_MIN_PAGES", 2)
+    monkeypatch.setattr(main, "_page_pool", broken)
+    assert PDFProcessor.extract_pdf_content(pdf_bytes) == serial
+    assert main._page_pool is None
+    assert broken.shut_down
+
+
+def test_stream_caches_by_extraction_time(monkeypatch):
+    """Slow clients do not make a fast extraction count as worth caching."""
+    import time
+    import main
+    from main import ResultCache, stream_extract_response
+
+    cache = ResultCache(max_entries=4, max_bytes=1024, min_duration_ms=20)
+    monkeypatch.setattr(main, "result_cache", cache)
+
+    def slow_chunks():
+        yield b"["
+        time.sleep(0.03)
+        yield b"]"
+
+    closed = []
+    for chunk in stream_extract_response(iter([b"[", b"]"]), "fast.pdf", b"fast", 0, lambda: closed.append(1)):
+        time.sleep(0.03)  # Slow network write
+    assert cache.get(b"fast") is None
+
+    assert b"".join(stream_extract_response(slow_chunks(), "slow.pdf", b"slow", 0, lambda: closed.append(1))) == b"[]"
+    assert cache.get(b"slow") == b"[]"
+    assert closed == [1, 1]
+
+
+def test_streamed_json_reports_errors_after_first_page(monkeypatch):
+    """A failure while streaming still produces complete JSON with success false."""
+    import orjson
+    import main
+
+    extract_page = PDFProcessor.extract_page
+
+    def failing_extract_page(doc, page_num, *args):
+        if page_num == 1:
+            raise RuntimeError("damaged page")
+        return extract_page(doc, page_num, *args)
+
+    monkeypatch.setattr(PDFProcessor, "extract_page", staticmethod(failing_extract_page))
+    cache = main.ResultCache(max_entries=4, max_bytes=1 << 20)
+    monkeypatch.setattr(main, "result_cache", cache)
+    pdf_bytes = make_pdf(page_count=3)
+    doc = fitz.open("pdf", pdf_bytes)
+    chunks = PDFProcessor.iter_pdf_content_json(pdf_bytes, doc)
+    body = b"".join(main.stream_extract_response(chunks, "damaged.pdf", b"key", 0, doc.close))
+
+    result = orjson.loads(body)
+    assert result["success"] is False
+    assert result["error"] == "Failed to process PDF: damaged page"
+    assert [page["page_number"] for page in result["content"]["pages"]] == [1]
+    assert cache.get(b"key") is None
+
+
+@pytest.mark.parametrize("query, message", [
+    ("format=xml", "Invalid format 'xml'"),
+    ("include=text,pixels", "Invalid include 'text,pixels'"),
+    ("pages=0", "Invalid pages '0'"),
+    ("pages=2-5", "Invalid pages '2-5'"),
+])
+def test_extract_rejects_invalid_options(query, message):
+    """Bad query options get a JSON 400 with CORS headers."""
+    import orjson
+
+    status, headers, body = call_app("POST", "/extract", query, make_pdf(page_count=2))
+    assert status.startswith("400")
+    assert headers["Access-Control-Allow-Origin"] == "*"
+    assert headers["Content-Type"] == "application/json"
+    assert orjson.loads(body)["message"].startswith(message)
+
+
+def test_extract_serves_cached_result(monkeypatch):
+    """A repeated request is answered from the result cache without opening the PDF."""
+    import orjson
+    import main
+
+    monkeypatch.setattr(main, "result_cache", main.ResultCache(max_entries=4, max_bytes=1 << 20))
+    pdf_bytes = make_pdf(page_count=2)
+    status, headers, first = call_app("POST", "/extract", "pages=2&include=text", pdf_bytes)
+    assert status.startswith("200")
+    assert headers["Access-Control-Allow-Origin"] == "*"
+    assert [page["page_number"] for page in orjson.loads(first)["content"]["pages"]] == [2]
+
+    def fail_acquire(*args):
+        raise AssertionError("document opened for a cached result")
+
+    monkeypatch.setattr(main.document_cache, "acquire", fail_acquire)
+    status, _, second = call_app("POST", "/extract", "pages=2&include=text", pdf_bytes)
+    assert status.startswith("200")
+    assert second == first
+
+
+def test_extract_options_preflight():
+    """CORS preflight requests are answered with the CORS headers."""
+    status, headers, _ = call_app("OPTIONS", "/extract")
+    assert status.startswith("200")
+    assert headers["Access-Control-Allow-Methods"] == "POST, OPTIONS"
+
+
+def test_cached_document_is_unlocked_between_chunks():
+    """The document lock is held while chunks are produced, not while they are consumed."""
+    from io import BytesIO
+    from main import DocumentCache, PDFUpload, pdf_content_key
+
+    pdf_bytes = make_pdf()
+    cache = DocumentCache(max_entries=1, max_bytes=10 * len(pdf_bytes))
+    key = pdf_content_key(pdf_bytes)
+    entry, _ = cache.acquire(key, PDFUpload("a.pdf", BytesIO(pdf_bytes)))
+
+    def chunks():
+        for page in entry.doc:
+            assert entry.lock.locked()
+            yield page.get_text().encode()
+
+    for chunk in entry.iter_locked(chunks()):
+        assert not entry.lock.locked()
+        upload = PDFUpload("a.pdf", BytesIO(pdf_bytes))
+        other, adopted = cache.acquire(key, upload)  # Does not wait for the first request
+        assert other is entry and not adopted
+        cache.release(other)
+        upload.close()
+    cache.release(entry)
+    assert not entry.doc.is_closed